@@ -15,7 +15,7 @@ def get_section_question_number(section, local_number):
     }
     return section_offsets[section] + local_number
 
-def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=None):
+def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=None, return_tiles=False):
     """
     Process a bubble sheet image through the complete workflow:
     1. Read and preprocess the image
@@ -28,6 +28,8 @@ def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=N
         bubble_sheet_path: Path to the bubble sheet image
         output_dir: Directory to save output files
         model_answers: Optional list of model answers (1-based indices)
+        return_tiles: If True, return (results, tiles) where tiles maps question
+            numbers to the processed question images, ready for combine_images
     """
     # Create output directories
     temp_dir = os.path.join(output_dir, 'temp')
@@ -40,7 +42,7 @@ def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=N
     cropped_image = process_images(bubble_sheet_path)
     if cropped_image is None:
         print("Error: Failed to process image")
-        return None
+        return (None, {}) if return_tiles else None
 
     # Step 2: Divide into thirds
     print("Step 2: Dividing image into thirds...")
@@ -57,6 +59,7 @@ def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=N
     # Initialize bubble detector
     detector = BubbleDetector()
     all_answers = []
+    tiles = {}
 
     # Process each section
     for section_name, section_image in sections.items():
@@ -113,6 +116,7 @@ def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=N
             # Save processed image
             output_path = os.path.join(results_dir, f'question_{global_question_num}.jpg')
             cv2.imwrite(output_path, result)
+            tiles[global_question_num] = result
             
             # Determine the answer (0,1,2,3)
             answer = None
@@ -207,6 +211,8 @@ def process_bubble_sheet(bubble_sheet_path, output_dir='output', model_answers=N
     print(f"Detailed results: {json_path}")
     print(f"Summary report: {summary_path}")
     
+    if return_tiles:
+        return results_dict, tiles
     return results_dict
 
 if __name__ == "__main__":
@@ -2,35 +2,50 @@ from PIL import Image
 import os
 import math
 import time
+import secrets
 import shutil
 
-def combine_images(output_dir='static'):
+def _map_question_files(image_dir):
+    """Map question numbers to the processed question images stored in image_dir"""
+    print(f"Looking for images in directory: {image_dir}")
+    
+    if not os.path.exists(image_dir):
+        print(f"Error: Image directory {image_dir} does not exist")
+        return {}
+        
+    # Get all question images
+    image_files = [f for f in os.listdir(image_dir) if f.startswith('question_') and f.endswith('.jpg')]
+    print(f"Found {len(image_files)} image files")
+    
+    # Create a dictionary to map question numbers to file paths
+    question_map = {}
+    for img_file in image_files:
+        try:
+            num = int(img_file.split('_')[1].split('.')[0])
+            question_map[num] = os.path.join(image_dir, img_file)
+        except (IndexError, ValueError) as e:
+            print(f"Error parsing filename {img_file}: {e}")
+            continue
+    return question_map
+
+def combine_images(output_dir='static', tiles=None):
+    """
+    Combine the processed question images into a single 3x15 grid image.
+    
+    Args:
+        output_dir: Directory to save the combined image in
+        tiles: Optional dict of question number -> BGR image array, as returned by
+            process_bubble_sheet(..., return_tiles=True). When given, the images are
+            used directly instead of being re-read from output/results.
+    """
     try:
-        # Directory containing the images
-        image_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output', 'results')
-        print(f"Looking for images in directory: {image_dir}")
-        
-        if not os.path.exists(image_dir):
-            print(f"Error: Image directory {image_dir} does not exist")
-            return False
-            
-        # Get all question images
-        image_files = [f for f in os.listdir(image_dir) if f.startswith('question_') and f.endswith('.jpg')]
-        print(f"Found {len(image_files)} image files")
-        
-        if not image_files:
-            print("No question images found to combine")
-            return False
-        
-        # Create a dictionary to map question numbers to filenames
-        question_map = {}
-        for img_file in image_files:
-            try:
-                num = int(img_file.split('_')[1].split('.')[0])
-                question_map[num] = img_file
-            except (IndexError, ValueError) as e:
-                print(f"Error parsing filename {img_file}: {e}")
-                continue
+        if tiles is not None:
+            # Tiles come from OpenCV in BGR order; PIL expects RGB
+            question_map = {num: Image.fromarray(tile[:, :, ::-1]) for num, tile in tiles.items()}
+        else:
+            # Directory containing the images
+            image_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output', 'results')
+            question_map = _map_question_files(image_dir)
         
         if not question_map:
             print("No valid question images found")
@@ -38,15 +53,16 @@ def combine_images(output_dir='static'):
             
         print(f"Successfully mapped {len(question_map)} questions")
         
+        def load(num):
+            source = question_map[num]
+            return source if tiles is not None else Image.open(source)
+        
         # Calculate grid dimensions (3x15 grid for 45 images)
         grid_width = 3
         grid_height = 15
         
         # Get dimensions of first image to determine cell size
-        first_image_path = os.path.join(image_dir, next(iter(question_map.values())))
-        print(f"Using first image for dimensions: {first_image_path}")
-        
-        first_image = Image.open(first_image_path)
+        first_image = load(next(iter(question_map)))
         cell_width, cell_height = first_image.size
         print(f"Cell dimensions: {cell_width}x{cell_height}")
         
@@ -58,32 +74,27 @@ def combine_images(output_dir='static'):
         for row in range(grid_height):
             # First column: 31-45 (previously was 1-15)
             if row + 31 in question_map:
-                img1_path = os.path.join(image_dir, question_map[row + 31])
-                print(f"Processing image for question {row + 31}: {img1_path}")
-                img1 = Image.open(img1_path)
-                combined_image.paste(img1, (0 * cell_width, row * cell_height))
+                print(f"Processing image for question {row + 31}")
+                combined_image.paste(load(row + 31), (0 * cell_width, row * cell_height))
             
             # Second column: 16-30 (stays the same)
             if row + 16 in question_map:
-                img2_path = os.path.join(image_dir, question_map[row + 16])
-                print(f"Processing image for question {row + 16}: {img2_path}")
-                img2 = Image.open(img2_path)
-                combined_image.paste(img2, (1 * cell_width, row * cell_height))
+                print(f"Processing image for question {row + 16}")
+                combined_image.paste(load(row + 16), (1 * cell_width, row * cell_height))
             
             # Third column: 1-15 (previously was 31-45)
             if row + 1 in question_map:
-                img3_path = os.path.join(image_dir, question_map[row + 1])
-                print(f"Processing image for question {row + 1}: {img3_path}")
-                img3 = Image.open(img3_path)
-                combined_image.paste(img3, (2 * cell_width, row * cell_height))
+                print(f"Processing image for question {row + 1}")
+                combined_image.paste(load(row + 1), (2 * cell_width, row * cell_height))
         
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         print(f"Ensured output directory exists: {output_dir}")
         
-        # Generate a unique filename with timestamp
+        # Generate a unique filename: the timestamp keeps names in age order, the random
+        # suffix keeps two images combined in the same second from overwriting each other
         timestamp = int(time.time())
-        combined_image_path = os.path.join(output_dir, f'combined_questions_{timestamp}.jpg')
+        combined_image_path = os.path.join(output_dir, f'combined_questions_{timestamp}_{secrets.token_hex(8)}.jpg')
         print(f"Generated unique filename: {combined_image_path}")
         
         # Save the new combined image
@@ -1,24 +1,33 @@
 from fastapi import FastAPI, File, UploadFile, Request, HTTPException, Response
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, FileResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+import aiofiles
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import BaseTarget
 import os
+import io
 import shutil
+import tempfile
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from combine_images import combine_images
-import json
+import orjson
 from bubble_scanner import process_bubble_sheet
 import time
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import uuid
+import secrets
+import hashlib
+from collections import OrderedDict
 from pathlib import Path
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
-import glob
 import base64
-from io import BytesIO
-from PIL import Image
-import requests  # Import requests at the top level
+import httpx
 import cv2  # Import cv2 for OpenCV
 import numpy as np  # Import numpy for array operations
 
@@ -31,6 +40,35 @@ logger = logging.getLogger(__name__)
 
 # Constants
 REQUIRED_BUBBLES_PER_QUESTION = 4
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # Largest decoded image accepted from clients
+MAX_UPLOAD_BYTES = MAX_IMAGE_BYTES + 5 * 1024 * 1024  # Largest single-image multipart body, form overhead included
+# Base64 inflates the image by 4/3; the rest covers the answer key and JSON framing
+MAX_GRADE_BODY_BYTES = MAX_IMAGE_BYTES * 4 // 3 + 1024 * 1024
+# A batch body is spooled to /tmp (memory on Cloud Run) before the handler runs, so it
+# gets a fixed total budget rather than one that scales with the file count
+MAX_BATCH_BODY_BYTES = 3 * MAX_UPLOAD_BYTES
+MAX_BATCH_FILES = 10  # Most sheets accepted by one /upload_batch request (typical phone photos fit the budget)
+# Leading bytes of the image formats OpenCV can read (WebP is checked separately)
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',   # PNG
+    b'BM',                  # BMP
+    b'II*\x00', b'MM\x00*',  # TIFF
+)
+BASE64_CHUNK_CHARS = 64 * 1024  # Multiple of 4 so every slice decodes on its own
+UPLOAD_COPY_CHUNK = 1024 * 1024  # Block size when an upload cannot be sendfile'd
+DOWNLOAD_CHUNK = 64 * 1024  # Block size when streaming an image from imageUrl
+HTTP_MAX_CONNECTIONS = 32  # Connections the shared download client keeps open at most
+MAX_DOWNLOAD_REDIRECTS = 5  # Redirects followed when downloading an imageUrl
+COMBINED_CACHE_SIZE = 32  # Most recent combined images kept in memory
+COMBINED_CACHE_TTL = 600  # Seconds an unrequested combined image stays cached
+COMBINED_CACHE_SWEEP_INTERVAL = 60  # Seconds between expiry sweeps
+IO_WORKERS = 4  # Threads for disk-bound work
+SCAN_WORKERS = os.cpu_count() or 1  # Scanning processes, and so sheets scanned at the same time
+STALE_SCRATCH_AGE = 3600  # Seconds after which an upload or work dir is assumed abandoned
+SCAN_CACHE_SIZE = 32  # Most recent scans kept in memory, keyed by image content hash
+# Keep a JSON copy of every /upload and /evaluate response in OUTPUT_DIR (for debugging)
+PERSIST_RESULTS = os.getenv("PERSIST_RESULTS", "").lower() in ("1", "true", "yes")
 
 # Use temp directory for all output and temp directories for Google Cloud Run compatibility
 BASE_DIR = Path(__file__).resolve().parent
@@ -40,10 +78,8 @@ TEMP_BASE = Path(os.environ.get('TEMP', '/tmp'))  # Use system temp directory
 OUTPUT_DIR = TEMP_BASE / "output/results"
 TEMP_DIR = TEMP_BASE / "output/temp"
 COMBINED_IMAGE_PATH = TEMP_DIR / "combined_questions.jpg"
-
-# Ensure directories exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(TEMP_DIR, exist_ok=True)
+COMBINED_DIR = TEMP_BASE / "output/combined"  # Per-request combined images shared by all workers
+UPLOAD_DIR = TEMP_BASE / "output/uploads"  # Streamed uploads, one uniquely named file per request
 
 class BubbleSheetData(BaseModel):
     imageUrl: str = None
@@ -61,46 +97,221 @@ class FileManager:
         TEMPLATES_DIR.mkdir(exist_ok=True)
         OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
         TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        COMBINED_DIR.mkdir(parents=True, exist_ok=True)
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
     
     @staticmethod
-    def cleanup_output_folder():
-        """Clean up the output folder"""
+    def _purge_dir(path: Path, keep_prefix: Optional[str] = None):
+        """Delete the regular files directly under path, except names starting with keep_prefix"""
         try:
-            if OUTPUT_DIR.exists():
-                for file in OUTPUT_DIR.glob("*"):
+            # scandir's DirEntry carries the file type, so no extra stat per entry
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if keep_prefix and entry.name.startswith(keep_prefix):
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
                     try:
-                        if file.is_file():
-                            file.unlink()
+                        os.unlink(entry.path)
                     except Exception as e:
-                        logger.error(f"Error deleting file {file}: {e}")
+                        logger.error(f"Error deleting file {entry.path}: {e}")
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"Error cleaning output folder: {e}")
+            logger.error(f"Error cleaning {path}: {e}")
     
     @staticmethod
-    def cleanup_static_folder():
-        """Clean up the static folder"""
+    def cleanup_output_folder():
+        """Clean up the output folder, keeping the stored model answers (and their temp file)"""
+        FileManager._purge_dir(OUTPUT_DIR, keep_prefix=MODEL_ANSWERS_FILE.stem)
+    
+    @staticmethod
+    def cleanup_temp_folder():
+        """Remove all files from the output/temp directory"""
+        FileManager._purge_dir(TEMP_DIR)
+
+    @staticmethod
+    def create_work_dir() -> Path:
+        """Create a private scratch folder for one request's scan and combine output"""
+        return Path(tempfile.mkdtemp(prefix="req_", dir=TEMP_DIR))
+
+    @staticmethod
+    def remove_work_dir(path: Path):
+        """Delete a request's scratch folder and everything in it"""
+        shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def remove_file(path: Path):
+        """Delete a file if it is still there"""
         try:
-            if TEMP_DIR.exists():
-                for file in TEMP_DIR.glob("*"):
-                    try:
-                        if file.is_file():
-                            file.unlink()
-                    except Exception as e:
-                        logger.error(f"Error deleting file {file}: {e}")
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"Error cleaning static folder: {e}")
+            logger.error(f"Error deleting file {path}: {e}")
 
     @staticmethod
-    def cleanup_temp_folder():
-        """Remove all files from the output/temp directory"""
+    def publish_file(source: Path, destination: Path) -> bytes:
+        """
+        Expose source under destination and return its contents. A hard link shares the
+        inode, which is safe because combine_images replaces rather than rewrites its output.
+        """
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+        return source.read_bytes()
+
+    @staticmethod
+    def expire_shared_combined_images(max_age: float):
+        """Remove per-request combined images older than max_age seconds"""
+        deadline = time.time() - max_age
         try:
-            temp_files = glob.glob(str(TEMP_DIR / '*'))
-            for f in temp_files:
-                if os.path.isfile(f):
-                    os.remove(f)
-            logger.info("Temp directory cleaned successfully")
+            with os.scandir(COMBINED_DIR) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < deadline:
+                            os.unlink(entry.path)
+                    except FileNotFoundError:
+                        # Another worker's sweep got there first
+                        pass
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"Error cleaning temp directory: {e}")
+            logger.error(f"Error expiring combined images: {e}")
+
+    @staticmethod
+    def remove_stale_scratch(max_age: float):
+        """
+        Remove uploads and req_*/batch_* work dirs older than max_age seconds, left
+        behind by a worker that was killed mid-request. The age check keeps this
+        from touching requests still in flight in other workers.
+        """
+        deadline = time.time() - max_age
+        for directory, prefixes in ((UPLOAD_DIR, None), (TEMP_DIR, ("req_",)), (TEMP_BASE / "output", ("batch_",))):
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if prefixes and not entry.name.startswith(prefixes):
+                            continue
+                        try:
+                            if entry.stat(follow_symlinks=False).st_mtime >= deadline:
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                shutil.rmtree(entry.path, ignore_errors=True)
+                            else:
+                                os.unlink(entry.path)
+                        except FileNotFoundError:
+                            # Another worker's startup got there first
+                            pass
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error removing stale files in {directory}: {e}")
+
+    @staticmethod
+    def _upload_fileno(fileobj):
+        """Return the OS file descriptor behind an upload, or None if it is held in memory"""
+        # fileno() on an unrolled SpooledTemporaryFile would force it onto disk first
+        if isinstance(fileobj, tempfile.SpooledTemporaryFile) and not fileobj._rolled:
+            return None
+        try:
+            return fileobj.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
+    @staticmethod
+    def save_upload(upload: UploadFile, destination: Path):
+        """
+        Persist an uploaded file, using an in-kernel sendfile copy when the upload
+        is already spooled to disk and large-block buffered copies otherwise
+        """
+        src = upload.file
+        with open(destination, "wb") as buffer:
+            src_fd = FileManager._upload_fileno(src)
+            if src_fd is not None and hasattr(os, "sendfile"):
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(src_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                offset = src.tell()
+                remaining = os.fstat(src_fd).st_size - offset
+                while remaining > 0:
+                    sent = os.sendfile(buffer.fileno(), src_fd, offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            else:
+                shutil.copyfileobj(src, buffer, length=UPLOAD_COPY_CHUNK)
+
+    @staticmethod
+    async def save_upload_async(upload: UploadFile, destination: Path):
+        """
+        Non-blocking save_upload: the whole copy runs as one job on the I/O threads,
+        so the payload is never buffered in full and the loop is never blocked
+        """
+        await run_in_io_pool(FileManager.save_upload, upload, destination)
+
+    @staticmethod
+    def save_base64_image(image_base64: str, destination: Path) -> str:
+        """
+        Decode a base64 string straight into a file, one slice at a time,
+        so peak memory stays at a single decoded chunk. Returns the SHA-256
+        hex digest of the decoded image. Raises binascii.Error on characters
+        outside the base64 alphabet and HTTPException if the data is not an image.
+        """
+        # Clients occasionally send line-wrapped base64; slices must stay 4-aligned
+        if any(c in image_base64 for c in "\n\r\t "):
+            image_base64 = "".join(image_base64.split())
+        if not image_base64:
+            raise ValueError("empty image data")
+        digest = hashlib.sha256()
+        with open(destination, "wb") as f:
+            for start in range(0, len(image_base64), BASE64_CHUNK_CHARS):
+                # validate=True rejects stray characters instead of silently dropping them
+                data = base64.b64decode(image_base64[start:start + BASE64_CHUNK_CHARS], validate=True)
+                if start == 0:
+                    check_image_signature(data[:12])
+                digest.update(data)
+                f.write(data)
+        return digest.hexdigest()
+
+class UploadChunkTarget(BaseTarget):
+    """streaming-form-data target that hands file chunks back to the caller to write"""
+    
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+    
+    def on_data_received(self, chunk: bytes):
+        self.chunks.append(chunk)
+
+class MaxSizeMiddleware:
+    """
+    ASGI middleware that answers 413 to any request whose Content-Length exceeds
+    the limit for its path (path_limits, else max_bytes), before a single byte of
+    the body is read or spooled to disk
+    """
+    
+    def __init__(self, app, max_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name != b"content-length":
+                    continue
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    response = ORJSONResponse({"detail": "Invalid Content-Length header"}, status_code=400)
+                    return await response(scope, receive, send)
+                if content_length > self.path_limits.get(scope["path"], self.max_bytes):
+                    response = ORJSONResponse({"detail": "Request body too large"}, status_code=413)
+                    return await response(scope, receive, send)
+                break
+        await self.app(scope, receive, send)
 
 class BubbleSheetValidator:
     """Handles validation of bubble sheet results"""
@@ -111,26 +322,65 @@ class BubbleSheetValidator:
         Validate that all questions have exactly 4 detected bubbles
         Returns True if valid, False otherwise
         """
-        if not results:
+        if not results or not isinstance(results, dict):
             return False
             
-        # Check if results is a dictionary
-        if not isinstance(results, dict):
-            return False
+        # Single pass that stops at the first bad question; nothing is formatted on success.
+        # Locals avoid a global lookup per question inside the generator.
+        required = REQUIRED_BUBBLES_PER_QUESTION
+        prefix = 'question_'
+        if all(
+            isinstance(data, dict) and data.get('bubbles_detected') == required
+            for question_key, data in results.items()
+            if question_key.startswith(prefix)
+        ):
+            return True
             
-        # Check each question's data
+        BubbleSheetValidator.log_invalid_results(results)
+        return False
+
+    @staticmethod
+    def summarize(results: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], bool, int]:
+        """
+        Single pass over the results for the /upload response.
+        Returns (invalid_questions, rejected_areas, all_valid, question_count).
+        """
+        required = REQUIRED_BUBBLES_PER_QUESTION
+        prefix = 'question_'
+        invalid_questions = []
+        rejected_areas = []
+        question_count = 0
+        for question_key, data in results.items():
+            if not question_key.startswith(prefix):
+                continue
+            question_count += 1
+            bubbles = data.get('bubbles_detected') if isinstance(data, dict) else None
+            if bubbles == required:
+                continue
+            question_number = question_key[len(prefix):]
+            invalid_questions.append({
+                'question_number': question_number,
+                'bubbles_detected': bubbles
+            })
+            # Add rejected areas information if available
+            for area in data.get('rejected_areas', ()) if isinstance(data, dict) else ():
+                rejected_areas.append({
+                    'question_number': question_number,
+                    'circularity': area.get('circularity', 0),
+                    'area': area.get('area', 0),
+                    'reason': area.get('reason', 'Unknown')
+                })
+        return invalid_questions, rejected_areas, not invalid_questions, question_count
+
+    @staticmethod
+    def log_invalid_results(results: Dict[str, Any]):
+        """Log every question that failed validation; only called on the failure path"""
         for question_key, data in results.items():
             if not question_key.startswith('question_'):
                 continue
-                
-            # Check if bubbles_detected exists and equals 4
-            if not isinstance(data, dict) or 'bubbles_detected' not in data:
-                return False
-            if data['bubbles_detected'] != REQUIRED_BUBBLES_PER_QUESTION:
-                logger.warning(f"Invalid bubble count for {question_key}: {data['bubbles_detected']}")
-                return False
-                
-        return True
+            bubbles = data.get('bubbles_detected') if isinstance(data, dict) else None
+            if bubbles != REQUIRED_BUBBLES_PER_QUESTION:
+                logger.warning(f"Invalid bubble count for {question_key}: {bubbles}")
 
 class ModelAnswers(BaseModel):
     number_of_questions: int
@@ -139,14 +389,60 @@ class ModelAnswers(BaseModel):
 # Define model answers file path
 MODEL_ANSWERS_FILE = OUTPUT_DIR / "model_answers.json"
 
+# (mtime_ns, size, parsed answers) for the current MODEL_ANSWERS_FILE
+_model_answers_cache: Optional[Tuple[int, int, ModelAnswers]] = None
+
+def load_model_answers(mtime_ns: int, size: int) -> ModelAnswers:
+    """
+    Parse MODEL_ANSWERS_FILE. Callers pass the file's current mtime and size so the
+    parsed copy is reused until the file changes.
+    """
+    global _model_answers_cache
+    cached = _model_answers_cache
+    if cached is not None and cached[0] == mtime_ns and cached[1] == size:
+        return cached[2]
+    with open(MODEL_ANSWERS_FILE, "rb") as f:
+        model_answers = ModelAnswers.model_validate_json(f.read())
+    _model_answers_cache = (mtime_ns, size, model_answers)
+    return model_answers
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for FastAPI application"""
     # Startup
+    # Worker processes for OpenCV-heavy scanning. Each worker keeps OpenCV single-threaded
+    # so the total thread count stays close to the core count under concurrent load.
+    app.state.process_pool = ProcessPoolExecutor(
+        max_workers=SCAN_WORKERS,
+        initializer=cv2.setNumThreads,
+        initargs=(1,)
+    )
+    # Threads for disk-bound work (image combining, file writes) so it can overlap with
+    # the event loop without occupying the scanning processes
+    app.state.io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+    # One slot per pool process, so waiting scans queue here (and can still be abandoned)
+    # rather than inside the pool
+    app.state.scan_slots = asyncio.Semaphore(SCAN_WORKERS)
+    # Recent combined images keyed by id, served from memory by /combined/{image_id}.jpg
+    app.state.combined_cache = OrderedDict()
+    # Scan (results, tiles) keyed by (image SHA-256, model answers), most recently used last
+    app.state.scan_cache = OrderedDict()
+    # The page templates take no context, so render them once instead of per request
+    app.state.pages = {name: render_static_page(name) for name in ("index.html", "evaluation.html")}
+    # Shared client for /grade image downloads, so connections (and their TLS sessions)
+    # are pooled across requests; HTTP/2 lets concurrent downloads from one host share one
+    app.state.http_client = httpx.AsyncClient(
+        timeout=30,
+        http2=True,
+        # Image URLs often redirect (http to https, CDN or signed-URL hops), as requests allowed
+        follow_redirects=True,
+        max_redirects=MAX_DOWNLOAD_REDIRECTS,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+    )
+    cache_sweeper = asyncio.create_task(sweep_combined_cache())
     try:
         # Create necessary directories
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        os.makedirs(TEMP_DIR, exist_ok=True)
+        FileManager.ensure_directories_exist()
         
         # Set proper permissions for the directories
         try:
@@ -156,26 +452,43 @@ async def lifespan(app: FastAPI):
             logger.warning(f"Could not set directory permissions: {e}")
         
         # Clean up old files
-        FileManager.cleanup_output_folder()
-        FileManager.cleanup_static_folder()
+        await run_in_io_pool(FileManager.cleanup_output_folder)
+        await run_in_io_pool(FileManager.cleanup_temp_folder)
+        await run_in_io_pool(FileManager.remove_stale_scratch, STALE_SCRATCH_AGE)
     except Exception as e:
         logger.error(f"Error during startup cleanup: {e}")
     
     yield
     
     # Shutdown
+    cache_sweeper.cancel()
+    app.state.scan_cache.clear()
+    await app.state.http_client.aclose()
     try:
-        FileManager.cleanup_output_folder()
-        FileManager.cleanup_static_folder()
+        await run_in_io_pool(FileManager.cleanup_output_folder)
+        await run_in_io_pool(FileManager.cleanup_temp_folder)
     except Exception as e:
         logger.error(f"Error during shutdown cleanup: {e}")
+    app.state.process_pool.shutdown(wait=False, cancel_futures=True)
+    app.state.io_pool.shutdown(wait=True)
 
 # Create FastAPI app
 app = FastAPI(
     title="Bubble Sheet Scanner API",
     description="API for processing bubble sheet images",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+# Reject oversized bodies up front; added before CORS so the 413 still carries CORS headers
+app.add_middleware(
+    MaxSizeMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    path_limits={
+        "/grade": MAX_GRADE_BODY_BYTES,
+        "/upload_batch": MAX_BATCH_BODY_BYTES,
+    }
 )
 
 # Add CORS middleware
@@ -193,74 +506,203 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 # Templates
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
+def run_in_cv_pool(func, *args, **kwargs):
+    """Submit a blocking OpenCV call to the worker processes and return a future to await"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(app.state.process_pool, partial(func, *args, **kwargs))
+
+def run_in_io_pool(func, *args, **kwargs):
+    """Start blocking disk work on the I/O threads and return a future to await later"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(app.state.io_pool, partial(func, *args, **kwargs))
+
+def render_static_page(name: str):
+    """Render a context-free template once, returning its HTML bytes and ETag"""
+    body = templates.get_template(name).render().encode()
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+def static_page_response(request: Request, name: str) -> Response:
+    """Serve a page pre-rendered at startup, answering revalidations with 304"""
+    body, etag = app.state.pages[name]
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
+def check_image_signature(head: bytes):
+    """Reject data whose leading bytes are not an image format OpenCV can read"""
+    is_webp = head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    if not (head.startswith(IMAGE_SIGNATURES) or is_webp):
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file type. Please upload a JPEG, PNG, BMP, TIFF or WebP image."
+        )
+
+async def validate_image_upload(file: UploadFile):
+    """
+    Reject oversized or non-image files before any executor work is done
+    (the request body as a whole is already capped by MaxSizeMiddleware)
+    """
+    if file.size is not None and file.size > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    head = await file.read(12)
+    await file.seek(0)
+    check_image_signature(head)
+
+async def receive_image_upload(request: Request, field_name: str = "file") -> Tuple[Path, str]:
+    """
+    Stream the image in a multipart request body straight to a new file in UPLOAD_DIR
+    as it arrives, without Starlette spooling the whole body first. Enforces
+    MAX_UPLOAD_BYTES on the bytes actually received and checks the image signature
+    as soon as the first bytes of the file are in. Returns the path of the saved file
+    and the SHA-256 hex digest of its contents.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    boundary = next(
+        (param.split("=", 1)[1].strip().strip('"') for param in content_type.split(";")[1:]
+         if param.strip().lower().startswith("boundary=")),
+        ""
+    )
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+    
+    file_path = UPLOAD_DIR / f"bubble_sheet_{uuid.uuid4().hex}.jpg"
+    received = 0
+    head = b""
+    digest = hashlib.sha256()
+    try:
+        target = UploadChunkTarget()
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register(field_name, target)
+        async with aiofiles.open(file_path, "wb") as buffer:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Image too large")
+                parser.data_received(chunk)
+                for data in target.chunks:
+                    if len(head) < 12:
+                        head += data[:12 - len(head)]
+                        if len(head) == 12:
+                            check_image_signature(head)
+                    digest.update(data)
+                    await buffer.write(data)
+                target.chunks.clear()
+        
+        if not head:
+            raise HTTPException(status_code=400, detail=f"No image data in the '{field_name}' field")
+        if len(head) < 12:
+            check_image_signature(head)
+    except HTTPException:
+        FileManager.remove_file(file_path)
+        raise
+    except Exception as e:
+        FileManager.remove_file(file_path)
+        logger.error(f"Error receiving upload: {e}")
+        raise HTTPException(status_code=400, detail="Malformed multipart upload")
+    return file_path, digest.hexdigest()
+
+async def scan_stage(file_path: Path, image_hash: str, work_dir: Path, model_answers=None):
+    """
+    Pipeline stage 1: scan the sheet in the process pool and return its (results, tiles).
+    Re-submitted images are answered from the scan cache without scanning again.
+    """
+    cache = app.state.scan_cache
+    key = (image_hash, tuple(model_answers) if model_answers is not None else None)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    async with app.state.scan_slots:
+        scanned = await run_in_cv_pool(
+            process_bubble_sheet, str(file_path), output_dir=str(work_dir),
+            model_answers=model_answers, return_tiles=True
+        )
+    if scanned[0] is not None:
+        cache[key] = scanned
+        while len(cache) > SCAN_CACHE_SIZE:
+            cache.popitem(last=False)
+    return scanned
+
+async def combine_stage(tiles, work_dir: Path) -> Optional[str]:
+    """
+    Pipeline stage 2: combine the question tiles in the request's work dir and publish
+    the image. Returns the combined image URL, or None if combining failed.
+    """
+    # A True return means the file was written
+    if not await run_in_io_pool(combine_images, output_dir=str(work_dir), tiles=tiles):
+        return None
+    combined_path = work_dir / COMBINED_IMAGE_PATH.name
+    combined_image_url = await cache_combined_image(combined_path)
+    # Atomically swap it in as the latest image for /output/combined_questions.jpg
+    await run_in_io_pool(os.replace, combined_path, COMBINED_IMAGE_PATH)
+    return combined_image_url
+
+async def cache_combined_image(image_path: Path) -> str:
+    """
+    Keep the freshly combined image in the in-memory LRU cache and return its URL.
+    Each request gets its own id, so a later scan cannot overwrite what a client is viewing.
+    """
+    image_id = uuid.uuid4().hex
+    # Publish under COMBINED_DIR so any worker can serve it
+    shared_path = COMBINED_DIR / f"{image_id}.jpg"
+    image_data = await run_in_io_pool(FileManager.publish_file, image_path, shared_path)
+    cache = app.state.combined_cache
+    cache[image_id] = (time.monotonic(), image_data)
+    while len(cache) > COMBINED_CACHE_SIZE:
+        cache.popitem(last=False)
+    return f"/combined/{image_id}.jpg"
+
+def expire_combined_cache():
+    """Drop combined images that have not been requested within COMBINED_CACHE_TTL"""
+    cache = app.state.combined_cache
+    deadline = time.monotonic() - COMBINED_CACHE_TTL
+    # Entries are kept in last-access order, so expired ones are always at the front
+    while cache and next(iter(cache.values()))[0] < deadline:
+        cache.popitem(last=False)
+
+async def sweep_combined_cache():
+    """Background task that periodically expires stale combined images"""
+    while True:
+        await asyncio.sleep(COMBINED_CACHE_SWEEP_INTERVAL)
+        expire_combined_cache()
+        await run_in_io_pool(FileManager.expire_shared_combined_images, COMBINED_CACHE_TTL)
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Serve the main page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return static_page_response(request, "index.html")
 
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """Upload and process a bubble sheet image"""
+async def upload_file(request: Request):
+    """Upload and process a bubble sheet image (multipart field 'file')"""
+    # Receive the upload before entering the pipeline so slow clients don't stall other scans
+    file_path, image_hash = await receive_image_upload(request)
+    work_dir = FileManager.create_work_dir()
     try:
-        # Clean up directories before processing
-        FileManager.cleanup_output_folder()
-        FileManager.cleanup_static_folder()
-        
-        # Generate unique filename with timestamp
         timestamp = int(time.time())
-        filename = f"bubble_sheet_{timestamp}.jpg"
-        file_path = OUTPUT_DIR / filename
-        
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
         
         # Process the image using bubble scanner
-        results = process_bubble_sheet(str(file_path))
+        results, tiles = await scan_stage(file_path, image_hash, work_dir)
         
         if results is None:
             raise HTTPException(status_code=500, detail="Failed to process bubble sheet")
         
-        # Check for questions with insufficient bubbles
-        invalid_questions = []
-        rejected_areas = []
-        
-        for question_key, data in results.items():
-            if not question_key.startswith('question_'):
-                continue
-                
-            if data['bubbles_detected'] != REQUIRED_BUBBLES_PER_QUESTION:
-                question_number = question_key.split('_')[1]
-                invalid_questions.append({
-                    'question_number': question_number,
-                    'bubbles_detected': data['bubbles_detected']
-                })
-                
-                # Add rejected areas information if available
-                if 'rejected_areas' in data:
-                    for area in data['rejected_areas']:
-                        rejected_areas.append({
-                            'question_number': question_number,
-                            'circularity': area.get('circularity', 0),
-                            'area': area.get('area', 0),
-                            'reason': area.get('reason', 'Unknown')
-                        })
+        # Check for questions with insufficient bubbles, in one pass over the results
+        invalid_questions, rejected_areas, all_valid, question_count = BubbleSheetValidator.summarize(results)
         
         # Check if all questions have 4 bubbles detected
-        not_four_bubbles = [q for q, qdata in results.items() if isinstance(qdata, dict) and qdata.get('bubbles_detected', 4) != 4]
-        if not_four_bubbles:
+        if not all_valid:
             raise HTTPException(
                 status_code=400,
                 detail="Please provide a more clear image and try again."
             )
         
         # After processing, combine all images
-        combine_images(output_dir=str(TEMP_DIR))
-        
-        # Check if combined image exists in temp
-        combined_image_path = TEMP_DIR / "combined_questions.jpg"
-        if not combined_image_path.exists():
-            return JSONResponse({
+        combined_image_url = await combine_stage(tiles, work_dir)
+        if combined_image_url is None:
+            return ORJSONResponse({
                 "results": results,
                 "error": "Failed to generate combined image"
             })
@@ -268,23 +710,25 @@ async def upload_file(file: UploadFile = File(...)):
         # Prepare response data
         response_data = {
             "results": results,
-            "combined_image": "/output/combined_questions.jpg",
+            "combined_image": combined_image_url,
             "validation": {
                 "has_errors": len(invalid_questions) > 0,
                 "invalid_questions": invalid_questions,
-                "total_questions": len([k for k in results.keys() if k.startswith('question_')]),
+                "total_questions": question_count,
                 "error_message": f"Questions {', '.join([q['question_number'] for q in invalid_questions])} have less than {REQUIRED_BUBBLES_PER_QUESTION} bubbles detected. Please ensure all bubbles are clearly visible." if invalid_questions else None
             },
             "rejected_areas": rejected_areas
         }
         
-        # Save JSON response to file
-        json_filename = f"results_{timestamp}.json"
-        json_path = OUTPUT_DIR / json_filename
-        with open(json_path, "w") as f:
-            json.dump(response_data, f, indent=4)
+        # Save JSON response to file when asked to keep results
+        if PERSIST_RESULTS:
+            json_filename = f"results_{timestamp}_{secrets.token_hex(8)}.json"
+            json_path = OUTPUT_DIR / json_filename
+            json_data = orjson.dumps(response_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+            async with aiofiles.open(json_path, "wb") as f:
+                await f.write(json_data)
         
-        return JSONResponse(response_data)
+        return ORJSONResponse(response_data)
         
     except HTTPException as he:
         # Re-raise HTTP exceptions
@@ -293,17 +737,65 @@ async def upload_file(file: UploadFile = File(...)):
         logger.error(f"Error processing file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Clean up output directory after processing
-        FileManager.cleanup_output_folder()
+        FileManager.remove_file(file_path)
+        await run_in_io_pool(FileManager.remove_work_dir, work_dir)
+
+@app.post("/upload_batch")
+async def upload_batch(files: List[UploadFile] = File(...)):
+    """Upload and process several bubble sheet images in one request"""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} images per batch")
+    for file in files:
+        await validate_image_upload(file)
+    
+    # Each sheet gets its own output directory, so the scans can run side by side in
+    # the process pool without sharing folders
+    batch_dir = Path(tempfile.mkdtemp(prefix="batch_", dir=TEMP_BASE / "output"))
+    
+    async def process_sheet(index: int, file: UploadFile) -> Dict[str, Any]:
+        sheet = {"filename": file.filename}
+        try:
+            sheet_dir = batch_dir / f"sheet_{index}"
+            sheet_dir.mkdir()
+            file_path = sheet_dir / "bubble_sheet.jpg"
+            await FileManager.save_upload_async(file, file_path)
+            
+            results, tiles = await run_in_cv_pool(
+                process_bubble_sheet, str(file_path), output_dir=str(sheet_dir), return_tiles=True
+            )
+            if results is None:
+                sheet["error"] = "Failed to process bubble sheet"
+                return sheet
+            sheet["results"] = results
+            
+            if not BubbleSheetValidator.validate_results(results):
+                sheet["error"] = "Please provide a more clear image where all bubbles are clearly visible and try again."
+                return sheet
+            
+            if not await run_in_io_pool(combine_images, output_dir=str(sheet_dir), tiles=tiles):
+                sheet["error"] = "Failed to generate combined image"
+                return sheet
+            sheet["combined_image"] = await cache_combined_image(sheet_dir / "combined_questions.jpg")
+        except Exception as e:
+            logger.error(f"Error processing {file.filename} in batch: {e}")
+            sheet["error"] = str(e)
+        return sheet
+    
+    try:
+        sheets = await asyncio.gather(*(process_sheet(i, f) for i, f in enumerate(files)))
+        return ORJSONResponse({"sheets": sheets})
+    finally:
+        await run_in_io_pool(shutil.rmtree, batch_dir, ignore_errors=True)
 
 @app.get("/evaluation", response_class=HTMLResponse)
 async def evaluation_page(request: Request):
     """Serve the evaluation page"""
-    return templates.TemplateResponse("evaluation.html", {"request": request})
+    return static_page_response(request, "evaluation.html")
 
 @app.post("/upload_model_answers")
 async def upload_model_answers(model_answers: ModelAnswers):
     """Store model answers in a JSON file"""
+    global _model_answers_cache
     try:
         # Validate the model answers
         if len(model_answers.answers) != model_answers.number_of_questions:
@@ -312,34 +804,56 @@ async def upload_model_answers(model_answers: ModelAnswers):
                 detail="Number of answers must match the number of questions"
             )
         
-        # Save model answers to JSON file
-        with open(MODEL_ANSWERS_FILE, "w") as f:
-            json.dump(model_answers.model_dump(), f, indent=4)
+        # Save model answers to JSON file via a temp file so readers never see a partial write
+        data = orjson.dumps(model_answers.model_dump(), option=orjson.OPT_INDENT_2)
+        # Each request gets its own temp file, so concurrent uploads can't truncate each other's
+        fd, tmp_name = tempfile.mkstemp(dir=OUTPUT_DIR, prefix=f"{MODEL_ANSWERS_FILE.stem}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_name, "wb") as f:
+                await f.write(data)
+            # Stat the temp file itself: the rename keeps its mtime and size, and the
+            # published file may already have been replaced by a concurrent upload
+            stat_result = os.stat(tmp_name)
+            os.replace(tmp_name, MODEL_ANSWERS_FILE)
+        except BaseException:
+            FileManager.remove_file(Path(tmp_name))
+            raise
+        
+        # Prime the cache with the answers just validated so /evaluate never re-parses them
+        _model_answers_cache = (stat_result.st_mtime_ns, stat_result.st_size, model_answers)
         
-        return JSONResponse({
+        return ORJSONResponse({
             "message": "Model answers saved successfully",
             "number_of_questions": model_answers.number_of_questions,
             "file_path": str(MODEL_ANSWERS_FILE)
         })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving model answers: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/evaluate")
-async def evaluate_bubble_sheet(file: UploadFile = File(...)):
-    """Evaluate a bubble sheet against stored model answers"""
+async def evaluate_bubble_sheet(request: Request):
+    """Evaluate a bubble sheet (multipart field 'file') against stored model answers"""
+    # Receive the upload before entering the pipeline so slow clients don't stall other scans
+    file_path, image_hash = await receive_image_upload(request)
+    work_dir = FileManager.create_work_dir()
+    combine_task = None
     try:
         # Check if model answers file exists
-        if not MODEL_ANSWERS_FILE.exists():
+        try:
+            model_answers_stat = MODEL_ANSWERS_FILE.stat()
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=400,
                 detail="No model answers found. Please upload model answers first using /upload_model_answers endpoint."
             )
         
-        # Load model answers from JSON file
+        # Load model answers from JSON file, reusing the cached parse while it is unchanged
         try:
-            with open(MODEL_ANSWERS_FILE, "r") as f:
-                model_answers = ModelAnswers(**json.load(f))
+            model_answers = load_model_answers(model_answers_stat.st_mtime_ns, model_answers_stat.st_size)
         except Exception as e:
             logger.error(f"Error loading model answers: {e}")
             raise HTTPException(
@@ -347,31 +861,16 @@ async def evaluate_bubble_sheet(file: UploadFile = File(...)):
                 detail="Error loading model answers. Please try uploading them again."
             )
         
-        # Ensure directories exist
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        os.makedirs(TEMP_DIR, exist_ok=True)
-        
-        # Clean up directories before processing
-        FileManager.cleanup_output_folder()
-        FileManager.cleanup_static_folder()
-        
-        # Generate unique filename with timestamp
         timestamp = int(time.time())
-        filename = f"bubble_sheet_{timestamp}.jpg"
-        file_path = OUTPUT_DIR / filename
-        
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
         
         # Process the image using bubble scanner
-        results = process_bubble_sheet(str(file_path), model_answers=model_answers.answers)
+        results, tiles = await scan_stage(file_path, image_hash, work_dir, model_answers=model_answers.answers)
         
         if results is None:
             raise HTTPException(status_code=500, detail="Failed to process bubble sheet")
         
         # Log the results for debugging
-        logger.info(f"Bubble sheet processing results: {json.dumps(results, indent=2)}")
+        logger.info(f"Bubble sheet processing results: {orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()}")
         
         # Validate the results
         if not BubbleSheetValidator.validate_results(results):
@@ -381,100 +880,83 @@ async def evaluate_bubble_sheet(file: UploadFile = File(...)):
                 detail="Please provide a more clear image where all bubbles are clearly visible and try again."
             )
         
-        # After processing, combine all images
+        # After processing, combine all images in the background while the answers are scored
         logger.info("Attempting to combine images...")
-        success = combine_images(output_dir=str(TEMP_DIR))
+        combine_task = asyncio.ensure_future(combine_stage(tiles, work_dir))
         
-        if not success:
-            logger.error("Failed to combine images")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to generate combined image. Please try again."
-            )
+        # Log model answers for debugging
+        logger.info(f"Model answers: {model_answers.model_dump()}")
+        
+        # Evaluate answers in a single pass; with at most 45 questions a plain loop is
+        # cheaper than building NumPy arrays for the comparison
+        evaluation_results = []
+        correct_count = 0
+        multiple_count = 0
+        # Loop-invariant lookups hoisted out of the per-question loop
+        answers = model_answers.answers
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for i in range(model_answers.number_of_questions):
+            question_data = results.get(f"question_{i+1}")
+            if question_data is None:
+                logger.warning(f"Question {i+1} not found in results")
+                student_answers = []
+                fill_ratios = []
+            elif not isinstance(question_data, dict):
+                logger.warning(f"Invalid data format for question {i+1}: {question_data}")
+                student_answers = []
+                fill_ratios = []
+            else:
+                # Use detected_answers (list) for evaluation
+                student_answers = question_data.get('detected_answers') or []
+                # Get fill ratios for debugging
+                fill_ratios = question_data.get('fill_ratios', [])
+            
+            correct_answer = answers[i]
+            
+            # Check if student selected multiple answers
+            has_multiple_answers = len(student_answers) > 1
+            
+            # Mark as correct if:
+            # 1. Student selected exactly one answer
+            # 2. That answer matches the correct answer (both in 4-0 format)
+            is_correct = len(student_answers) == 1 and student_answers[0] == correct_answer
+            
+            if is_correct:
+                correct_count += 1
+            if has_multiple_answers:
+                multiple_count += 1
+            
+            # Format student answer for display
+            if not student_answers:
+                student_answer_display = "No Answer"
+            elif has_multiple_answers:
+                student_answer_display = f"Multiple: {student_answers}"
+            else:
+                student_answer_display = str(student_answers[0])
+            
+            evaluation_results.append({
+                "question": i + 1,
+                "student_answers": student_answers,
+                "student_answer_display": student_answer_display,
+                "correct_answer": correct_answer,
+                "is_correct": is_correct,
+                "has_multiple_answers": has_multiple_answers,
+                "fill_ratios": fill_ratios  # Add fill ratios for debugging
+            })
+            
+            # Per-question detail is only formatted when debug logging is on
+            if debug:
+                logger.debug(f"Question {i+1} evaluation: student={student_answers}, display={student_answer_display}, correct={correct_answer}, is_correct={is_correct}, multiple_answers={has_multiple_answers}, fill_ratios={fill_ratios}")
         
-        # Check if combined image exists
-        combined_image_path = COMBINED_IMAGE_PATH
-        if not combined_image_path.exists():
-            logger.error(f"Combined image not found at {combined_image_path}")
+        combined_image_url = await combine_task
+        if combined_image_url is None:
+            logger.error("Failed to combine images")
             raise HTTPException(
                 status_code=500,
                 detail="Failed to generate combined image. Please try again."
             )
             
-        logger.info(f"Successfully generated combined image at {combined_image_path}")
-        
-        # Evaluate answers
-        evaluation_results = []
-        correct_count = 0
-        
-        # Log model answers for debugging
-        logger.info(f"Model answers: {model_answers.model_dump()}")
-        
-        for i in range(model_answers.number_of_questions):
-            question_key = f"question_{i+1}"
-            try:
-                if question_key not in results:
-                    logger.warning(f"Question {i+1} not found in results")
-                    student_answers = []
-                else:
-                    question_data = results[question_key]
-                    if not isinstance(question_data, dict):
-                        logger.warning(f"Invalid data format for question {i+1}: {question_data}")
-                        student_answers = []
-                    else:
-                        # Use detected_answers (list) for evaluation
-                        detected_answers = question_data.get('detected_answers', [])
-                        student_answers = detected_answers if detected_answers else []
-                
-                correct_answer = model_answers.answers[i]
-                
-                # Check if student selected multiple answers
-                has_multiple_answers = len(student_answers) > 1
-                
-                # Mark as correct if:
-                # 1. Student selected exactly one answer
-                # 2. That answer matches the correct answer (both in 4-0 format)
-                is_correct = not has_multiple_answers and len(student_answers) == 1 and student_answers[0] == correct_answer
-                
-                if is_correct:
-                    correct_count += 1
-                
-                # Format student answer for display
-                if not student_answers:
-                    student_answer_display = "No Answer"
-                elif has_multiple_answers:
-                    student_answer_display = f"Multiple: {student_answers}"
-                else:
-                    student_answer_display = str(student_answers[0])
-                
-                # Get fill ratios for debugging
-                fill_ratios = question_data.get('fill_ratios', []) if isinstance(question_data, dict) else []
-                
-                evaluation_results.append({
-                    "question": i + 1,
-                    "student_answers": student_answers,
-                    "student_answer_display": student_answer_display,
-                    "correct_answer": correct_answer,
-                    "is_correct": is_correct,
-                    "has_multiple_answers": has_multiple_answers,
-                    "fill_ratios": fill_ratios  # Add fill ratios for debugging
-                })
-                
-                # Log each question evaluation for debugging
-                logger.info(f"Question {i+1} evaluation: student={student_answers}, display={student_answer_display}, correct={correct_answer}, is_correct={is_correct}, multiple_answers={has_multiple_answers}, fill_ratios={fill_ratios}")
-                
-            except Exception as e:
-                logger.error(f"Error evaluating question {i+1}: {e}")
-                evaluation_results.append({
-                    "question": i + 1,
-                    "error": str(e),
-                    "student_answers": [],
-                    "student_answer_display": "Error",
-                    "correct_answer": model_answers.answers[i],
-                    "is_correct": False,
-                    "has_multiple_answers": False,
-                    "fill_ratios": []
-                })
+        logger.info(f"Successfully generated combined image at {COMBINED_IMAGE_PATH}")
         
         # Calculate score
         score = (correct_count / model_answers.number_of_questions) * 100
@@ -486,18 +968,20 @@ async def evaluate_bubble_sheet(file: UploadFile = File(...)):
                 "total_questions": model_answers.number_of_questions,
                 "correct_answers": correct_count,
                 "score": score,
-                "questions_with_multiple_answers": sum(1 for r in evaluation_results if r.get('has_multiple_answers', False))
+                "questions_with_multiple_answers": multiple_count
             },
-            "combined_image": "/output/combined_questions.jpg"
+            "combined_image": combined_image_url
         }
         
-        # Save JSON response to file
-        json_filename = f"evaluation_{timestamp}.json"
-        json_path = OUTPUT_DIR / json_filename
-        with open(json_path, "w") as f:
-            json.dump(response_data, f, indent=4)
+        # Save JSON response to file when asked to keep results
+        if PERSIST_RESULTS:
+            json_filename = f"evaluation_{timestamp}_{secrets.token_hex(8)}.json"
+            json_path = OUTPUT_DIR / json_filename
+            json_data = orjson.dumps(response_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+            async with aiofiles.open(json_path, "wb") as f:
+                await f.write(json_data)
 
-        return JSONResponse(response_data)
+        return ORJSONResponse(response_data)
         
     except HTTPException as he:
         # Re-raise HTTP exceptions
@@ -506,8 +990,57 @@ async def evaluate_bubble_sheet(file: UploadFile = File(...)):
         logger.error(f"Error processing file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Clean up output directory after processing
-        FileManager.cleanup_output_folder()
+        FileManager.remove_file(file_path)
+        # Let a combine still running in the work dir finish before removing it
+        if combine_task is not None:
+            await asyncio.gather(combine_task, return_exceptions=True)
+        await run_in_io_pool(FileManager.remove_work_dir, work_dir)
+
+def add_score_banner(image_path: Path, score_text: str):
+    """Prepend a white banner with the score text to the image at image_path, in place"""
+    # Read the combined image with OpenCV to add score
+    img = cv2.imread(str(image_path))
+    if img is not None:
+        # Add white area at the top
+        white_height = 80  # Height of white area
+        new_height = img.shape[0] + white_height
+        new_img = np.ones((new_height, img.shape[1], 3), dtype=np.uint8) * 255
+        new_img[white_height:, :] = img
+        
+        # Further enhanced black line removal and gap removal
+        N = 60  # Scan more rows for robustness
+        threshold = 80  # Lower threshold to catch lighter lines
+
+        scan_rows = new_img[white_height:white_height+N, :]
+        gray = cv2.cvtColor(scan_rows, cv2.COLOR_BGR2GRAY)
+        row_means = np.mean(gray, axis=1)
+
+        # Find contiguous block of dark rows (likely a line)
+        black_mask = row_means < threshold
+        if np.any(black_mask):
+            indices = np.where(black_mask)[0]
+            start = max(indices[0] - 2, 0)  # Remove 2 rows above
+            end = min(indices[-1] + 2, N-1)  # Remove 2 rows below
+            # Remove the gap by vertically stacking the parts above and below the white area
+            part_above = new_img[:white_height + start, :]
+            part_below = new_img[white_height + end + 1:, :]
+            new_img = np.vstack([part_above, part_below])
+        
+        # Add score text to the white area
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = 1.5
+        font_thickness = 3
+        
+        # Get text size and position it at the center of white area
+        (text_width, text_height), _ = cv2.getTextSize(score_text, font, font_scale, font_thickness)
+        text_x = (new_img.shape[1] - text_width) // 2  # Center horizontally
+        text_y = (white_height + text_height) // 2  # Center vertically in white area
+        
+        # Add the score text
+        cv2.putText(new_img, score_text, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness)
+        
+        # Save the modified image
+        cv2.imwrite(str(image_path), new_img)
 
 @app.post("/grade")
 async def grade_bubble_sheet(request: BubbleSheetData):
@@ -517,6 +1050,9 @@ async def grade_bubble_sheet(request: BubbleSheetData):
     - JSON with student answers as a dict {"1": 3, ...}
     - Student score
     """
+    # The downloaded/decoded image goes to the upload folder under a unique name
+    file_path = UPLOAD_DIR / f"bubble_sheet_{uuid.uuid4().hex}.jpg"
+    work_dir = FileManager.create_work_dir()
     try:
         # Parse model answers from answer_key dict
         if not isinstance(request.answer_key, dict):
@@ -525,34 +1061,47 @@ async def grade_bubble_sheet(request: BubbleSheetData):
             sorted_items = sorted(request.answer_key.items(), key=lambda x: int(x[0]))
             model_answers_list = [v for k, v in sorted_items]
             question_numbers = [int(k) for k, v in sorted_items]
+            if not all(type(v) is int for v in model_answers_list):
+                raise ValueError("answer_key values must be integers")
         except Exception:
             raise HTTPException(status_code=400, detail="answer_key must have integer string keys and integer values.")
 
         # Download image from imageUrl or decode from imageBase64
         if request.imageBase64:
+            # Reject oversized payloads before allocating anything for the decode
+            if (len(request.imageBase64) * 3) >> 2 > MAX_IMAGE_BYTES:
+                raise HTTPException(status_code=413, detail="Image too large")
             try:
-                image_data = base64.b64decode(request.imageBase64)
-                image = Image.open(BytesIO(image_data))
-                timestamp = int(time.time())
-                filename = f"bubble_sheet_{timestamp}.jpg"
-                file_path = OUTPUT_DIR / filename
-                image.save(file_path)
+                image_hash = await run_in_io_pool(FileManager.save_base64_image, request.imageBase64, file_path)
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Failed to decode base64 image: {e}")
         elif request.imageUrl:
             try:
                 logger.info(f"Attempting to download image from URL: {request.imageUrl}")
-                response = requests.get(request.imageUrl, timeout=30)
-                response.raise_for_status()
-                
-                timestamp = int(time.time())
-                filename = f"bubble_sheet_{timestamp}.jpg"
-                file_path = OUTPUT_DIR / filename
-                
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
+                # Stream the body to disk as it arrives instead of buffering it all
+                digest = hashlib.sha256()
+                received = 0
+                async with app.state.http_client.stream("GET", request.imageUrl) as response:
+                    response.raise_for_status()
+                    async with aiofiles.open(file_path, "wb") as f:
+                        async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK):
+                            received += len(chunk)
+                            if received > MAX_IMAGE_BYTES:
+                                raise HTTPException(status_code=413, detail="Image too large")
+                            if received == len(chunk):
+                                # First chunk: make sure it is an image before going further
+                                check_image_signature(chunk[:12])
+                            digest.update(chunk)
+                            await f.write(chunk)
+                if not received:
+                    raise HTTPException(status_code=400, detail="Downloaded image is empty")
+                image_hash = digest.hexdigest()
                 logger.info(f"Successfully downloaded and saved image to: {file_path}")
-            except requests.exceptions.RequestException as e:
+            except HTTPException:
+                raise
+            except httpx.HTTPError as e:
                 logger.error(f"Error downloading image from URL: {e}")
                 raise HTTPException(status_code=400, detail=f"Failed to download image from URL: {str(e)}")
             except Exception as e:
@@ -562,7 +1111,7 @@ async def grade_bubble_sheet(request: BubbleSheetData):
             raise HTTPException(status_code=400, detail="No image provided. Please provide imageUrl or imageBase64.")
 
         # Process the image using bubble scanner
-        results = process_bubble_sheet(str(file_path), model_answers=model_answers_list)
+        results, tiles = await scan_stage(file_path, image_hash, work_dir, model_answers=model_answers_list)
         
         if results is None:
             raise HTTPException(status_code=500, detail="Failed to process bubble sheet")
@@ -594,64 +1143,19 @@ async def grade_bubble_sheet(request: BubbleSheetData):
                 student_answers[str(qnum)] = None
 
         # Always re-generate the combined image for each /grade call to ensure freshness
-        success = combine_images(output_dir=str(TEMP_DIR))
-        if not success:
+        if not await run_in_io_pool(combine_images, output_dir=str(work_dir), tiles=tiles):
             raise HTTPException(status_code=500, detail="Failed to generate combined image.")
 
-        combined_img_path = TEMP_DIR / "combined_questions.jpg"
-        if not combined_img_path.exists():
-            raise HTTPException(status_code=500, detail="Failed to generate combined image.")
+        combined_img_path = work_dir / COMBINED_IMAGE_PATH.name
 
-        # Read the combined image with OpenCV to add score
-        img = cv2.imread(str(combined_img_path))
-        if img is not None:
-            # Add white area at the top
-            white_height = 80  # Height of white area
-            new_height = img.shape[0] + white_height
-            new_img = np.ones((new_height, img.shape[1], 3), dtype=np.uint8) * 255
-            new_img[white_height:, :] = img
-            
-            # Further enhanced black line removal and gap removal
-            N = 60  # Scan more rows for robustness
-            threshold = 80  # Lower threshold to catch lighter lines
-
-            scan_rows = new_img[white_height:white_height+N, :]
-            gray = cv2.cvtColor(scan_rows, cv2.COLOR_BGR2GRAY)
-            row_means = np.mean(gray, axis=1)
-
-            # Find contiguous block of dark rows (likely a line)
-            black_mask = row_means < threshold
-            if np.any(black_mask):
-                indices = np.where(black_mask)[0]
-                start = max(indices[0] - 2, 0)  # Remove 2 rows above
-                end = min(indices[-1] + 2, N-1)  # Remove 2 rows below
-                # Remove the gap by vertically stacking the parts above and below the white area
-                part_above = new_img[:white_height + start, :]
-                part_below = new_img[white_height + end + 1:, :]
-                new_img = np.vstack([part_above, part_below])
-            
-            # Add score text to the white area
-            score_text = f"Score: {correct_count}/{len(model_answers_list)}"
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 1.5
-            font_thickness = 3
-            
-            # Get text size and position it at the center of white area
-            (text_width, text_height), _ = cv2.getTextSize(score_text, font, font_scale, font_thickness)
-            text_x = (new_img.shape[1] - text_width) // 2  # Center horizontally
-            text_y = (white_height + text_height) // 2  # Center vertically in white area
-            
-            # Add the score text
-            cv2.putText(new_img, score_text, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness)
-            
-            # Save the modified image
-            cv2.imwrite(str(combined_img_path), new_img)
+        # Add the score banner on the I/O threads; OpenCV releases the GIL while it works
+        score_text = f"Score: {correct_count}/{len(model_answers_list)}"
+        await run_in_io_pool(add_score_banner, combined_img_path, score_text)
 
-        # Convert to base64 for response
-        pil_img = Image.open(str(combined_img_path)).convert("RGB")
-        buffered = BytesIO()
-        pil_img.save(buffered, format="JPEG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        # The file is already a JPEG, so base64 its bytes as they are
+        async with aiofiles.open(combined_img_path, "rb") as f:
+            img_base64 = base64.b64encode(await f.read()).decode()
+        await run_in_io_pool(os.replace, combined_img_path, COMBINED_IMAGE_PATH)
 
         # Calculate score (exclude multi-answers and unanswered from correct count)
         score = (correct_count / len(model_answers_list)) * 100 if len(model_answers_list) > 0 else 0
@@ -670,37 +1174,82 @@ async def grade_bubble_sheet(request: BubbleSheetData):
     except Exception as e:
         logger.error(f"Error in grade_bubble_sheet: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        FileManager.remove_file(file_path)
+        await run_in_io_pool(FileManager.remove_work_dir, work_dir)
 
 @app.get("/output/combined_questions.jpg")
-async def get_combined_image():
+async def get_combined_image(request: Request):
     """Serve the combined questions image from the temp directory"""
     try:
-        if not COMBINED_IMAGE_PATH.exists():
+        # One stat gives both existence and the validator for conditional requests
+        try:
+            stat_result = os.stat(COMBINED_IMAGE_PATH)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="Combined image not found")
-            
-        # Read the image file
-        with open(COMBINED_IMAGE_PATH, 'rb') as f:
-            image_data = f.read()
-            
-        # Generate a unique ETag based on file modification time
-        etag = str(os.path.getmtime(COMBINED_IMAGE_PATH))
-        
-        return Response(
-            content=image_data,
-            media_type="image/jpeg",
-            headers={
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0",
-                "ETag": etag
-            }
+        
+        # Every scan swaps in a new file, so the inode changes along with the image
+        etag = f'W/"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        headers = {
+            # Let the browser keep its copy but revalidate it on every poll
+            "Cache-Control": "private, max-age=0, must-revalidate",
+            "ETag": etag
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+        
+        # FileResponse streams from disk (sendfile where the server supports it); handing it
+        # the stat we already have spares it a second one
+        return FileResponse(
+            str(COMBINED_IMAGE_PATH), media_type="image/jpeg", headers=headers, stat_result=stat_result
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving combined image: {e}")
         raise HTTPException(status_code=500, detail="Error serving image")
 
+@app.get("/combined/{image_id}.jpg")
+async def get_cached_combined_image(image_id: str):
+    """Serve a combined image produced by an earlier /upload or /evaluate call"""
+    expire_combined_cache()
+    cache = app.state.combined_cache
+    entry = cache.get(image_id)
+    if entry is None:
+        # Produced by another worker (or evicted here); fall back to the shared copy
+        if not image_id.isalnum():
+            raise HTTPException(status_code=404, detail="Combined image not found")
+        shared_path = COMBINED_DIR / f"{image_id}.jpg"
+        try:
+            image_data = await run_in_io_pool(shared_path.read_bytes)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Combined image not found")
+    else:
+        image_data = entry[1]
+    cache[image_id] = (time.monotonic(), image_data)
+    cache.move_to_end(image_id)
+    while len(cache) > COMBINED_CACHE_SIZE:
+        cache.popitem(last=False)
+    return Response(
+        content=image_data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=300"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    # Scanning already fans out over the process pool, and each extra worker starts a
+    # pool of its own, so extra workers are opt-in via WORKERS.
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=int(os.getenv("WORKERS", 1)),
+        loop="auto",  # uvloop when installed
+        http="httptools"
+    )
\ No newline at end of file
@@ -108,10 +108,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 });
                 html += `</tbody></table>`;
                 if (data.combined_image) {
-                    // Add timestamp and random number to prevent caching
-                    const timestamp = new Date().getTime();
-                    const random = Math.random();
-                    const imgUrl = `/output/combined_questions.jpg?t=${timestamp}&r=${random}`;
+                    // Each evaluation gets its own image URL, so no cache-busting is needed
+                    const imgUrl = data.combined_image;
                     
                     // Create image element with loading handler
                     const imgContainer = document.createElement('div');
@@ -126,8 +126,8 @@ document.addEventListener('DOMContentLoaded', function () {
                     }
                 }
                 if (data.combined_image) {
-                    // Prefer /output/combined_questions.jpg endpoint for always-fresh image
-                    const imgUrl = '/output/combined_questions.jpg?t=' + new Date().getTime();
+                    // Each upload gets its own image URL, so no cache-busting is needed
+                    const imgUrl = data.combined_image;
                     html += `<div class='mt-4'><img src="${imgUrl}" class="img-fluid" alt="Combined Results"></div>`;
                 }
                 results.innerHTML = html;